@@ -1,10 +1,15 @@
 ## Model settings
-MODEL_NAME = 'whisper-small.en'
+MODEL_NAME = 'small.en' # faster-whisper model size, downloaded into a folder of the same name
 LANGUAGE = 'en'
 
 ## Processing settings
-MAX_NUMBER_OF_PROCESSES = 1 # The maximum number of videos which can be processed simultaneously
-NUM_THREADS = 12 # The number of threads used to save the editted video
+MAX_NUMBER_OF_PROCESSES = 1 # The maximum number of videos which can be processed simultaneously on the CPU (one per GPU when CUDA is available)
+NUM_THREADS = 12 # The number of CPU threads used to transcribe and save the editted videos, split evenly between the processes
+BATCH_SIZE = 8 # The number of 30 second audio chunks Whisper transcribes in one batch
+VAD_FILTER = True # Skip silent parts of the audio (detected with Silero VAD) instead of transcribing them, when off the audio is transcribed sequentially without batching
+VIDEO_CODEC = 'libx264' # Encoder used to save the editted video, use 'h264_nvenc' (NVIDIA) or 'h264_vaapi' (Intel/AMD) to encode on the GPU
+VIDEO_BITRATE = '5M' # Target bitrate used by the GPU encoders
+VAAPI_DEVICE = '/dev/dri/renderD128' # Render device used by the 'h264_vaapi' encoder
 
 ## Font settings
 # FONT_NAME = 'Super Carnival.ttf' # The name of the font file used for captions
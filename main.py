@@ -1,19 +1,29 @@
+import bisect
+import functools
+import hashlib
 import math
 import multiprocessing
 import os
 import random
-import shutil
 import time
 import logging
 import subprocess
-
+import tempfile
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing.managers import SyncManager
+
+import ctranslate2
 import numpy as np
 from PIL import Image, ImageDraw, ImageFont
-from moviepy.editor import (VideoFileClip, clips_array, concatenate_videoclips,
-                             ImageClip, CompositeVideoClip, VideoClip)
+from moviepy.editor import VideoFileClip, clips_array, VideoClip
+from moviepy.config import get_setting
 from moviepy.video.fx.all import crop as moviepy_crop
-import whisper_timestamped as whisper
+from faster_whisper import BatchedInferencePipeline, WhisperModel, download_model
 
+from transcription import load_audio, transcribe
 from config import (
     BACKGROUND_VIDEOS_DIR,
     FONT_BORDER_WEIGHT,
@@ -28,70 +38,59 @@ from config import (
     TEXT_POSITION_PERCENT,
     MODEL_NAME,
     LANGUAGE,
-    NUM_THREADS
+    NUM_THREADS,
+    BATCH_SIZE,
+    VAD_FILTER,
+    VIDEO_CODEC,
+    VIDEO_BITRATE,
+    VAAPI_DEVICE
 )
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-class VideoTools:
-    # Initialize the VideoTools class with a VideoFileClip
-    clip: VideoFileClip = None
+# Batched Whisper pipeline loaded once per worker process by _init_worker
+_MODEL = None
+# Rendered caption images shared between the worker processes, set by _init_worker
+_TEXT_CACHE = None
+# Share of the NUM_THREADS budget each worker uses for transcribing and for encoding,
+# so concurrent videos don't oversubscribe the CPU
+_WORKER_THREADS = max(1, NUM_THREADS // MAX_NUMBER_OF_PROCESSES)
 
-    def __init__(self, clip: VideoFileClip) -> None:
-        """Constructor to initialize the VideoFileClip."""
-        self.clip = clip
+def crop_clip(clip: VideoFileClip, width: int, height: int, max_source_width: int = None) -> VideoFileClip:
+    """Crop a video clip to the specified width and height.
 
-    def __deinit__(self) -> None:
-        """Destructor to clean up resources."""
-        if self.clip:
-            self.clip.close()  # Close the clip to free resources
-            self.clip = None  # Set clip to None to avoid dangling reference
+    The largest centered region with the target aspect ratio is cropped from the
+    source and resized once, so only a single crop and a single resize are applied.
 
-    def crop(self, width: int, height: int) -> VideoFileClip:
-        """Crop the video clip to the specified width and height.
+    Args:
+        clip (VideoFileClip): The video clip to crop.
+        width (int): The desired width of the cropped video.
+        height (int): The desired height of the cropped video.
+        max_source_width (int): Optionally limit the region to this many of the
+            central source columns.
+
+    Returns:
+        VideoFileClip: The cropped video clip.
+    """
+    # Get the original dimensions of the video clip
+    original_width, original_height = clip.size
+    available_width = min(original_width, max_source_width or original_width)
 
-        Args:
-            width (int): The desired width of the cropped video.
-            height (int): The desired height of the cropped video.
+    # Determine the maximum ratio to maintain aspect ratio
+    max_ratio = max(width / available_width, height / original_height)
 
-        Returns:
-            VideoFileClip: The cropped video clip.
-        """
-        # Get the original dimensions of the video clip
-        original_width, original_height = self.clip.size
-
-        # Calculate the change ratios for width and height
-        width_change_ratio = width / original_width
-        height_change_ratio = height / original_height
-
-        # Determine the maximum ratio to maintain aspect ratio
-        max_ratio = max(width_change_ratio, height_change_ratio)
-
-        # Resize the clip based on the maximum ratio
-        self.clip = self.clip.resize((
-            original_width * max_ratio,
-            original_height * max_ratio,
-        ))
-
-        # Get the new dimensions after resizing
-        new_width, new_height = self.clip.size
-
-        # Crop the video based on the aspect ratio
-        if width_change_ratio > height_change_ratio:
-            # Calculate the vertical crop
-            height_change = new_height - height
-            new_y1 = round(height_change / 2)  # Calculate the starting y-coordinate
-            new_y2 = min(new_y1 + height, new_height)  # Calculate the ending y-coordinate
-            self.clip = moviepy_crop(self.clip, y1=new_y1, y2=new_y2)  # Crop the video
-        elif height_change_ratio > width_change_ratio:
-            # Calculate the horizontal crop
-            width_change = new_width - width
-            new_x1 = round(width_change / 2)  # Calculate the starting x-coordinate
-            new_x2 = min(new_x1 + width, new_width)  # Calculate the ending x-coordinate
-            self.clip = moviepy_crop(self.clip, x1=new_x1, x2=new_x2)  # Crop the video
-            self.clip = self.clip.resize((width, height))  # Resize to the final dimensions
-
-        return self.clip  # Return the cropped video clip
+    # Calculate the centered source region which fills the target once resized
+    source_width = min(available_width, round(width / max_ratio))
+    source_height = min(original_height, round(height / max_ratio))
+    x1 = round((original_width - source_width) / 2)  # Calculate the starting x-coordinate
+    y1 = round((original_height - source_height) / 2)  # Calculate the starting y-coordinate
+
+    # Crop the source region and resize it to the final dimensions
+    clip = moviepy_crop(clip, x1=x1, y1=y1, width=source_width, height=source_height)
+    if (source_width, source_height) != (width, height):
+        clip = clip.resize((width, height))
+
+    return clip  # Return the cropped video clip
 
 
 class Tools:
@@ -122,15 +121,14 @@ class BackgroudVideo:
         # Trim the selected clip to the specified duration
         trimmed_clip = BackgroudVideo.trim_clip(full_clip, duration)
 
-        # Crop the trimmed clip to 90% of its width
-        width, height = trimmed_clip.size
-        trimmed_clip = VideoTools(trimmed_clip).crop(round(width * 0.9), height)
-
         # Get the target resolution for the final clip
         target_resolution = BackgroudVideo.get_target_resolution()
-        
-        # Crop the trimmed clip to the target resolution
-        cropped_clip = VideoTools(trimmed_clip).crop(target_resolution[0], target_resolution[1])
+
+        # Crop the central 90% of the width to the target resolution in a single pass
+        width, _ = trimmed_clip.size
+        cropped_clip = crop_clip(
+            trimmed_clip, target_resolution[0], target_resolution[1], max_source_width=round(width * 0.9)
+        )
 
         # Return the cropped clip without audio
         return cropped_clip.set_audio(None)
@@ -164,10 +162,12 @@ class BackgroudVideo:
         return clip.subclip(clip_start_time, clip_start_time + duration)
 
     @staticmethod
+    @functools.cache
     def get_target_resolution():
         """
         Calculates the target resolution for the video clip based on the full resolution
-        and the percentage reduction for the main clip.
+        and the percentage reduction for the main clip. The result only depends on the
+        config, so it is computed once.
 
         :return: A tuple containing the target width and height.
         """
@@ -188,22 +188,54 @@ class BackgroudVideo:
         for clip_name in clips:
             # Load each clip and crop it to the full resolution
             clip = VideoFileClip(os.path.join(BACKGROUND_VIDEOS_DIR, clip_name))
-            clip = VideoTools(clip).crop(FULL_RESOLUTION[0], FULL_RESOLUTION[1])
+            clip = crop_clip(clip, FULL_RESOLUTION[0], FULL_RESOLUTION[1])
 
             # Save the formatted clip back to the directory
             clip.write_videofile(os.path.join(BACKGROUND_VIDEOS_DIR, clip_name), codec="libx264", audio_codec="aac")
 
 import logging
 
+@functools.lru_cache(maxsize=1)
+def _get_font(font_path: str, font_size: int) -> ImageFont.FreeTypeFont:
+    """Load a TrueType font, reusing it while the path and size stay the same."""
+    return ImageFont.truetype(font_path, font_size)
+
+class TextImageCache:
+    """Bounded LRU cache of rendered caption images, hosted by a manager process for all workers."""
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self.images = OrderedDict()
+        self.lock = threading.Lock()  # The manager serves each worker from its own thread
+
+    def get(self, key):
+        """Return the cached value for the key, or None, marking it as recently used."""
+        with self.lock:
+            value = self.images.get(key)
+            if value is not None:
+                self.images.move_to_end(key)
+            return value
+
+    def set(self, key, value) -> None:
+        """Store a value, evicting the least recently used entries beyond max_size."""
+        with self.lock:
+            self.images[key] = value
+            self.images.move_to_end(key)
+            while len(self.images) > self.max_size:
+                self.images.popitem(last=False)
+
+class CacheManager(SyncManager):
+    pass
+
+CacheManager.register('TextImageCache', TextImageCache)
+
 class VideoCreation:
-    # Class attributes for video and audio clips
+    # Class attribute for the video clip
     clip = None
-    audio = None
 
     def __init__(self, clip: VideoFileClip) -> None:
         # Initialize the VideoCreation object with a video clip
         self.clip = clip
-        self.audio = clip.audio  # Extract audio from the video clip
 
     def __deinit__(self) -> None:
         # Clean up resources by closing video
@@ -211,59 +243,46 @@ class VideoCreation:
             self.clip.close()
             self.clip = None
 
-    def process(self) -> VideoClip:
-        # Main processing function to create the final video with captions
-        transcription = self.create_transcription(self.audio)  # Generate transcription from audio
-
-        if not transcription:
-            logging.warning("No transcription available. Returning original clip without captions.")
-            return self.clip
-
-        self.clip = self.add_captions_to_video(self.clip, transcription)  # Add captions to the video
-
-        return self.clip  # Return the processed video clip
-
-    def create_transcription(self, audio):
-        # Generate transcription from the audio
-        os.makedirs("temp", exist_ok=True)  # Create a temporary directory for audio files
+    def create_overlay(self):
+        # Transcribe the audio and build a function drawing the captions onto a frame,
+        # or return None if there is nothing to draw
+        samples = load_audio(self.clip.filename)  # Decode the audio for Whisper
+        if samples.size == 0:
+            logging.warning("No audio stream. Video will not have captions.")
+            return None
 
-        # Create a unique file name for the audio file
-        file_dir = f"temp/{time.time() * 10**20:.0f}.mp3"
-        audio.write_audiofile(file_dir, codec="mp3", verbose=False, logger=None)  # Save audio to file
+        transcription = self.create_transcription(samples)  # Generate transcription from audio
 
-        # Wait until the audio file is created
-        while not os.path.exists(file_dir):
-            time.sleep(0.01)
+        if not transcription:
+            logging.warning("No transcription available. Video will not have captions.")
+            return None
 
-        # Load the audio file and transcribe it
-        loaded_audio = whisper.load_audio(file_dir)
-        model = whisper.load_model(MODEL_NAME, device="cpu")
-        result = whisper.transcribe(model, loaded_audio, language=LANGUAGE, verbose=None)
+        return self.create_caption_overlay(self.clip, transcription)
 
-        # Clean up the temporary audio file
-        try:
-            os.remove(file_dir)
-        except FileNotFoundError:
-            pass
+    def create_transcription(self, samples):
+        # Transcribe the samples with the worker's model, when VAD_FILTER is on voice activity
+        # detection splits the audio into speech chunks so silence is never encoded
+        segments, _ = transcribe(_MODEL, samples, VAD_FILTER, BATCH_SIZE, language=LANGUAGE, word_timestamps=True)
 
         timestamps = []  # List to hold timestamps and words
 
         # Extract timestamps and words from the transcription result
-        for segment in result['segments']:
-            for word in segment['words']:
+        # (segments is a generator, decoding happens while iterating)
+        for segment in segments:
+            for word in segment.words:
                 timestamps.append({
-                    'timestamp': (word['start'], word['end']),
-                    'text': word['text']
+                    'timestamp': (word.start, word.end),
+                    'text': word.word.strip()
                 })
 
         return timestamps  # Return the list of timestamps and words
 
-    def add_captions_to_video(self, clip, timestamps):
-        # Add captions to the video based on the provided timestamps
+    def create_caption_overlay(self, clip, timestamps):
+        # Group the provided timestamps into captions and build their overlay
         if len(timestamps) == 0:
-            return clip  # Return the original clip if no timestamps
+            return None  # No overlay if no timestamps
 
-        clips = []  # List to hold video clips with captions
+        captions = []  # List of (start, end, text) caption segments
         start_time = 0  # Track the start time of each caption segment
         caption_text = ""  # Accumulates words for a caption
         max_caption_words = 12  # Maximum number of words per caption segment
@@ -280,74 +299,281 @@ class VideoCreation:
 
             # Check for end of sentence or word limit
             if word_count >= max_caption_words or word.endswith(('.', '!', '?', 'Mr.', 'Mrs.', 'Dr.', 'Ms.')):
-                captioned_clip = self.add_text_to_video(clip.subclip(start_time, end), caption_text.strip())
-                clips.append(captioned_clip)
+                captions.append((start_time, end, caption_text.strip()))
 
                 # Reset for the next caption segment
                 start_time = end
                 caption_text = ""
                 word_count = 0
 
-        # Add any remaining caption as the last clip
+        # Add any remaining caption as the last segment
         if caption_text:
-            captioned_clip = self.add_text_to_video(clip.subclip(start_time, clip.duration), caption_text.strip())
-            clips.append(captioned_clip)
+            captions.append((start_time, clip.duration, caption_text.strip()))
 
-        # Concatenate all clips with captions
-        final_clip = concatenate_videoclips(clips)
+        return self.create_text_overlay(clip, captions)  # Return the overlay drawing the captions
 
-        return final_clip  # Return the final clip with captions
-
-    def add_text_to_video(self, clip, text):
-        # Add text overlay to the video clip without stroke
+    def create_text_overlay(self, clip, captions):
+        # Build a function overlaying each caption on a frame during its (start, end) interval without stroke
         font_path = os.path.join(FONTS_DIR, FONT_NAME)
         if not os.path.exists(font_path):
             logging.error(f"Font file not found: {font_path}")
-            return clip  # Return original clip if font is missing
-
-        # Create the text image without stroke
-        text_image = self.create_text_image(text, font_path, FONT_SIZE, clip.size[0])
-        if text_image is None:
-            logging.error("Failed to create text image.")
-            return clip
-
-        image_clip = ImageClip(np.array(text_image), duration=clip.duration)  # Create an image clip for the text
+            return None  # No overlay if font is missing
+
+        # Render every caption once, keeping the intervals sorted by start time.
+        # Each image is split up front into contiguous float32 premultiplied RGB and inverse
+        # alpha arrays, so blending a frame is two vectorised NumPy calls over the caption strip.
+        starts, ends, overlays = [], [], []
+        for start, end, text in captions:
+            text_image = self.create_text_image(text, font_path, FONT_SIZE, clip.size[0])
+            if text_image is None:
+                logging.error("Failed to create text image.")
+                continue
+            rgb = np.ascontiguousarray(text_image[..., :3])
+            alpha = np.ascontiguousarray(text_image[..., 3:4], dtype=np.float32) / 255
+            y_offset = clip.size[1] - text_image.shape[0] - 10  # Position 10 pixels above the bottom edge
+
+            starts.append(start)
+            ends.append(end)
+            overlays.append((rgb * alpha, 1 - alpha, slice(y_offset, y_offset + text_image.shape[0])))
+
+        def overlay(frame, t):
+            # Find the caption which started most recently and check it is still showing
+            index = bisect.bisect_right(starts, t) - 1
+            if index < 0 or t > ends[index]:
+                return frame
+
+            # Alpha blend the text onto its strip of a copy of the frame
+            premultiplied_rgb, inverse_alpha, rows = overlays[index]
+            output = frame.copy()
+            strip = output[rows]
+            np.multiply(strip, inverse_alpha, out=strip, casting='unsafe')
+            np.add(strip, premultiplied_rgb, out=strip, casting='unsafe')
+            return output
+
+        return overlay
 
-        # Position the text at the bottom of the video
-        y_offset = clip.size[1] - text_image.size[1] - 10  # Position 10 pixels above the bottom edge
-        clip = CompositeVideoClip([clip, image_clip.set_position(("center", y_offset))])  # Overlay text on the video
-
-        return clip  # Return the video clip with text
+    @staticmethod
+    @functools.lru_cache(maxsize=512)
+    def create_text_image(text, font_path, font_size, max_width):
+        # Get the RGBA array for the text, rendering it only if no worker has done so yet
+        # Results are cached and shared between captions, so they must not be modified
+        key = hashlib.blake2b(f"{text}|{font_path}|{font_size}|{max_width}".encode()).digest()
+        if _TEXT_CACHE is not None:
+            cached = _TEXT_CACHE.get(key)
+            if cached is not None:
+                data, shape = cached
+                return np.frombuffer(data, dtype=np.uint8).reshape(shape)
+
+        text_image = VideoCreation.render_text_image(text, font_path, font_size, max_width)
+        if text_image is not None and _TEXT_CACHE is not None:
+            _TEXT_CACHE.set(key, (text_image.tobytes(), text_image.shape))
+        return text_image
 
-    def create_text_image(self, text, font_path, font_size, max_width):
-        # Create an image with the specified text without stroke
+    @staticmethod
+    def render_text_image(text, font_path, font_size, max_width):
+        # Create an RGBA array with the specified text without stroke
         try:
-            font = ImageFont.truetype(font_path, font_size)  # Load the specified font
+            font = _get_font(font_path, font_size)  # Load the specified font
         except IOError:
             logging.error(f"Unable to load font from {font_path}")
             return None
 
-        image = Image.new("RGBA", (max_width, font_size * 10), (0, 0, 0, 0))  # Create a transparent image
+        # Size the image from the font metrics instead of over-allocating and cropping
+        ascent, descent = font.getmetrics()
+        line_height = ascent + descent
+        image = Image.new("RGBA", (max_width, math.ceil(line_height * 1.6)), (0, 0, 0, 0))  # Create a transparent image
         draw = ImageDraw.Draw(image)  # Create a drawing context
 
-        # Get the bounding box for the text
-        _, _, w, h = draw.textbbox((0, 0), text, font=font)
+        # Measure the width of the text from the font's advances, without rasterising it
+        w = font.getlength(text)
 
         # Draw the text without stroke
         draw.text(
-            ((max_width - w) / 2, round(h * 0.2)),  # Centered text
+            ((max_width - w) / 2, round(line_height * 0.2)),  # Centered text
             text,
             font=font,
             fill="white"  # Text color without stroke
         )
 
-        image = image.crop((0, 0, max_width, round(h * 1.6)))  # Crop the image to the desired size
-        return image  # Return the created text image
+        return np.array(image)  # Return the created text image
+
+
+class VideoWriter:
+    @staticmethod
+    def get_encoder_args(width: int, height: int) -> list:
+        """
+        Builds the ffmpeg output arguments for the configured video encoder.
+
+        :param width: The width of the encoded frames.
+        :param height: The height of the encoded frames.
+        :return: A list of ffmpeg arguments selecting and configuring the encoder.
+        """
+        # yuv420p needs even dimensions, so like moviepy's writer only request it when they are
+        pix_fmt_args = ['-pix_fmt', 'yuv420p'] if width % 2 == 0 and height % 2 == 0 else []
+        if VIDEO_CODEC == 'libx264':
+            return ['-c:v', 'libx264', '-preset', 'medium', '-threads', str(_WORKER_THREADS)] + pix_fmt_args
+        if VIDEO_CODEC == 'h264_nvenc':
+            return ['-c:v', 'h264_nvenc', '-preset', 'p4', '-b:v', VIDEO_BITRATE] + pix_fmt_args
+        if VIDEO_CODEC == 'h264_vaapi':
+            # Frames have to be uploaded to the GPU surface format before encoding
+            return ['-vf', 'format=nv12,hwupload', '-c:v', 'h264_vaapi', '-b:v', VIDEO_BITRATE]
+        return ['-c:v', VIDEO_CODEC, '-b:v', VIDEO_BITRATE]
+
+    @staticmethod
+    def iter_frames(clip: VideoClip, duration: float, reader=None):
+        """
+        Iterates over the frames of a clip up to the given duration.
+
+        When the clip's own ffmpeg reader is given, the file is decoded in one sequential
+        pass rather than looking up (and possibly seeking to) every frame time with
+        get_frame. Only pass it for an untransformed VideoFileClip: derived clips
+        (subclip, fl, resize, crop...) keep the reader attribute but not its frames.
+
+        :param clip: The clip to read.
+        :param duration: The number of seconds of the clip to read.
+        :param reader: The FFMPEG_VideoReader of an untransformed VideoFileClip, optional.
+        :return: A generator of (time, frame) tuples.
+        """
+        if reader is None:
+            yield from clip.subclip(t_end=duration).iter_frames(fps=clip.fps, with_times=True, dtype='uint8')
+            return
 
+        reader.initialize()  # Restart decoding from the first frame
+        for index in range(math.ceil(round(duration * clip.fps, 6))):
+            frame = reader.read_frame()
+            reader.pos = index + 1  # Keep the reader's position in sync for later get_frame calls
+            yield index / clip.fps, frame[:, :, :3]
+
+    @staticmethod
+    def write(clip: VideoClip, output_path: str, audio_source: str, overlay=None,
+              duration: float = None, reader=None, prefetch: int = 32) -> None:
+        """
+        Encodes a clip by piping its raw frames into ffmpeg, muxing in the audio of
+        the source file in the same pass.
+
+        Decoding, drawing the overlay and encoding run as a three stage pipeline: a
+        reader thread decodes frames, this thread applies the overlay and a writer
+        thread feeds ffmpeg. Bounded queues between the stages apply backpressure.
+
+        :param clip: The clip whose frames are encoded.
+        :param output_path: The path of the video file to write.
+        :param audio_source: The path of the file the audio track is copied from.
+        :param overlay: An optional function (frame, t) -> frame applied to every frame.
+        :param duration: The number of seconds of the clip to write, the whole clip by default.
+        :param reader: The clip's own ffmpeg reader when the clip is an untransformed
+            VideoFileClip, to decode it sequentially (see iter_frames).
+        :param prefetch: The maximum number of frames queued between two stages.
+        :raises IOError: If ffmpeg fails to write the video.
+        """
+        width, height = clip.size
+        command = [get_setting("FFMPEG_BINARY"), '-y', '-loglevel', 'error']
+        if VIDEO_CODEC == 'h264_vaapi':
+            command += ['-vaapi_device', VAAPI_DEVICE]
+        command += [
+            '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{width}x{height}', '-r', str(clip.fps), '-i', '-',
+            '-i', audio_source,
+            '-map', '0:v:0', '-map', '1:a:0?',  # The source may not have an audio track
+        ]
+        command += VideoWriter.get_encoder_args(width, height)
+        command += ['-c:a', 'aac', '-shortest', output_path]
+
+        # ffmpeg's errors go to a temporary file rather than a pipe, so a long error log
+        # can't fill the pipe buffer and block ffmpeg while frames are still being sent
+        error_log = tempfile.TemporaryFile()
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=error_log)
+        read_queue = queue.Queue(maxsize=prefetch)
+        write_queue = queue.Queue(maxsize=prefetch)
+        stop = threading.Event()
+        encoder_exited = threading.Event()
+        read_errors = []
+
+        def read_frames():
+            # Decode frames ahead of the overlay stage, ending with a None sentinel
+            try:
+                for t, frame in VideoWriter.iter_frames(clip, duration or clip.duration, reader):
+                    if stop.is_set():
+                        break
+                    read_queue.put((t, frame))
+            except Exception as e:
+                read_errors.append(e)
+            finally:
+                read_queue.put(None)
+
+        def write_frames():
+            # Pipe frames into ffmpeg until the None sentinel. If ffmpeg exits, tell the other
+            # stages to stop and keep draining the queue so they never block on it
+            broken = False
+            while True:
+                frame = write_queue.get()
+                if frame is None:
+                    break
+                if broken:
+                    continue
+                try:
+                    process.stdin.write(frame.tobytes())
+                except BrokenPipeError:
+                    broken = True  # ffmpeg exited early, its error is reported below
+                    encoder_exited.set()
+                    stop.set()
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+
+        reader_thread = threading.Thread(target=read_frames, daemon=True)
+        writer_thread = threading.Thread(target=write_frames, daemon=True)
+        reader_thread.start()
+        writer_thread.start()
+
+        def discard_output():
+            # Remove the truncated video left behind by a failed write
+            try:
+                os.remove(output_path)
+            except FileNotFoundError:
+                pass
+
+        completed = False
+        try:
+            while True:
+                item = read_queue.get()
+                if item is None or stop.is_set():
+                    break
+                t, frame = item
+                write_queue.put(overlay(frame, t) if overlay else frame)
+            completed = True
+        finally:
+            write_queue.put(None)
+            if not completed:
+                process.kill()  # Stop ffmpeg, the writer then drains its queue
+
+            # Unblock the reader if it is waiting on a full queue after an error
+            stop.set()
+            while reader_thread.is_alive():
+                try:
+                    read_queue.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            writer_thread.join()
+
+            if not completed:
+                process.wait()
+                error_log.close()
+                discard_output()
+
+        process.wait()
+        error_log.seek(0)
+        error = error_log.read()
+        error_log.close()
+
+        if read_errors:
+            discard_output()
+            raise read_errors[0]
+        if process.returncode != 0 or encoder_exited.is_set():
+            discard_output()
+            raise IOError(f"ffmpeg failed to write {output_path}: {error.decode(errors='ignore').strip()}")
 
 import os
 import time
-import shutil
 import multiprocessing
 from moviepy.editor import VideoFileClip
 
@@ -355,51 +581,60 @@ from moviepy.editor import VideoFileClip
 INPUT_VIDEOS_DIR = 'input_videos'
 OUTPUT_VIDEOS_DIR = 'output_videos'
 
-def start_process(file_name, processes_status_dict, video_queue: multiprocessing.Queue):
+def _init_worker(text_cache, worker_counter, num_gpus):
+    """
+    Load the Whisper model once into each worker process of the pool.
+
+    Args:
+        text_cache (TextImageCache): A manager proxy caching rendered caption images across workers.
+        worker_counter (multiprocessing.Value): A shared counter used to number the workers.
+        num_gpus (int): The number of CUDA devices available, 0 to run on the CPU.
+    """
+    global _MODEL, _TEXT_CACHE
+    _TEXT_CACHE = text_cache
+
+    if num_gpus > 0:
+        # Give each worker its own GPU, running the model in FP16
+        with worker_counter.get_lock():
+            worker_id = worker_counter.value
+            worker_counter.value += 1
+        model = WhisperModel(MODEL_NAME, device="cuda", device_index=worker_id % num_gpus, compute_type="float16")
+    else:
+        model = WhisperModel(MODEL_NAME, device="cpu", compute_type="int8", cpu_threads=_WORKER_THREADS)
+    _MODEL = BatchedInferencePipeline(model=model)
+
+
+def start_process(file_name):
     """
     Process a video file by applying transformations and saving the output.
 
     Args:
         file_name (str): The name of the video file to process.
-        processes_status_dict (dict): A dictionary to track the status of processes.
-        video_queue (multiprocessing.Queue): A queue to manage video processing tasks.
     """
     
     logging.info(f"Processing: {file_name}")  # Log the start of processing
     start_time = time.time()  # Record the start time
 
-    # Get the current process identifier
-    process_identifier = multiprocessing.current_process().pid
-
-    # Mark the process as not finished in the status dictionary
-    processes_status_dict[process_identifier] = False
-
     # Load the input video file
-    input_video = VideoFileClip(os.path.join(INPUT_VIDEOS_DIR, file_name))
+    input_path = os.path.join(INPUT_VIDEOS_DIR, file_name)
+    # Whisper decodes the audio itself and the writer muxes it from the file, so skip moviepy's audio reader
+    input_video = VideoFileClip(input_path, audio=False)
     
-    # Process the video using a custom VideoCreation class
-    output_video = VideoCreation(input_video).process()
+    # Build the caption overlay using a custom VideoCreation class
+    overlay = VideoCreation(input_video).create_overlay()
     
     logging.info(f"Saving: {file_name}")  # Log the saving process
 
-    # Define the output directory and calculate the end time for the subclip
+    # Define the output directory and calculate the end time of the output video
     output_dir = os.path.join(OUTPUT_VIDEOS_DIR, file_name)
-    end_time = round(((output_video.duration * 100 // output_video.fps) * output_video.fps / 100), 2)
-    
-    # Create a subclip of the output video
-    output_video = output_video.subclip(t_end=end_time)
+    end_time = round(((input_video.duration * 100 // input_video.fps) * input_video.fps / 100), 2)
 
     # Attempt to save the output video, retrying up to 5 times on failure
     for pos in range(5):
         try:
-            output_video.write_videofile(
-                output_dir,
-                codec="libx264",
-                audio_codec="aac",
-                fps=output_video.fps,
-                threads=NUM_THREADS,
-                verbose=False,
-                logger=None
+            # The input is decoded in one pass and the captions are drawn while it is written
+            VideoWriter.write(
+                input_video, output_dir, input_path, overlay=overlay, duration=end_time, reader=input_video.reader
             )
             break  # Exit the loop if saving is successful
         except IOError:
@@ -408,76 +643,28 @@ def start_process(file_name, processes_status_dict, video_queue: multiprocessing
     else:
         logging.error(f"ERROR Saving: {file_name}")  # Log if all attempts failed
     
-    # Close the input and output video files to free resources
+    # Close the input video file to free resources
     input_video.close()
-    output_video.close()
 
     # Log the runtime of the processing
     logging.info(f"Runtime: {round(time.time() - start_time, 2)} - {file_name}")
-    
-    # Mark the process as finished in the status dictionary
-    processes_status_dict[process_identifier] = True
 
 
-def delete_temp_folder():
+def download_whisper_model():
     """
-    Delete the temporary folder used for processing videos.
+    Download the CTranslate2 conversion of the Whisper model into the MODEL_NAME folder.
     """
-    try:
-        shutil.rmtree('temp')  # Remove the 'temp' directory and all its contents
-    except (PermissionError, FileNotFoundError):
-        pass  # Ignore permission errors if the folder cannot be deleted or is not found
-
-
-import subprocess
-
-def check_command(command):
-    try:
-        # Run the command and check if it is installed
-        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        if result.returncode == 0:
-            return result.stdout.strip()
-        else:
-            return None
-    except Exception as e:
-        return str(e)
-
-def clone_respository():
-    
-    
-    # Check for Git
-    git_version = check_command(['git', '--version'])
-    if not git_version:
-        raise Exception("Git is not installed. Git must be installed to download model.")
-
-    git_lfs_version = check_command(['git', 'lfs', 'version'])
-    if not git_lfs_version:
-        raise Exception("Git LFS is not installed. LFS is required to download model. Install Git LFS and try again.")
-        
-
-    repo_url = f'https://huggingface.co/openai/{MODEL_NAME}'
-    
-    logging.info(f"Cloning {repo_url}")
-    # Run the git clone command
-    subprocess.run(['git', 'clone', repo_url], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True)
-    logging.info(f"Cloned {repo_url}")
-    
+    logging.info(f"Downloading {MODEL_NAME}")
+    download_model(MODEL_NAME, output_dir=MODEL_NAME)
+    logging.info(f"Downloaded {MODEL_NAME}")
 
 
 if __name__ == '__main__':
-    # Clean up any temporary folders before starting
-    delete_temp_folder()
-    
     if not os.path.exists(MODEL_NAME):
         logging.warning(f'Model {MODEL_NAME} not found.')
         logging.info('Downloading model...')
-        clone_respository()
+        download_whisper_model()
         
-    # Create a manager for shared data between processes
-    manager = multiprocessing.Manager()
-    processes_status_dict = manager.dict()  # Dictionary to track process statuses
-    video_queue = multiprocessing.Queue()    # Queue to hold video file names
-
     # Create input and output directories if they don't exist
     os.makedirs(INPUT_VIDEOS_DIR, exist_ok=True)
     os.makedirs(OUTPUT_VIDEOS_DIR, exist_ok=True)
@@ -485,36 +672,37 @@ if __name__ == '__main__':
     # List all video files in the input directory
     input_video_names = os.listdir(INPUT_VIDEOS_DIR)
 
-    # Add video file names to the queue
-    for name in input_video_names:
-        video_queue.put(name)
+    # Create a manager for the caption image cache shared between processes, bounded to
+    # the most recently used captions (each one is a full width RGBA strip)
+    manager = CacheManager()
+    manager.start()
+    text_cache = manager.TextImageCache(256)
+
+    # Run one worker per GPU when CUDA is available, otherwise use the CPU. CUDA can't be
+    # used in forked children once the parent has queried it, so GPU workers are spawned.
+    num_gpus = ctranslate2.get_cuda_device_count()
+    if num_gpus > 0:
+        logging.info(f'Using {num_gpus} GPU(s)')
+        num_workers = num_gpus
+        mp_context = multiprocessing.get_context('spawn')
+    else:
+        num_workers = MAX_NUMBER_OF_PROCESSES
+        mp_context = multiprocessing.get_context()
+    worker_counter = mp_context.Value('i', 0)
 
-    processes = {} # Dictionary to store processes
-    num_active_processes = 0  # Counter for active processes
     logging.info('STARTED')
 
-    # Main loop to manage video processing
-    while (video_queue.qsize() != 0) or (len(processes) != 0):
-        # Check if we can start a new process
-        if (num_active_processes < MAX_NUMBER_OF_PROCESSES) and (video_queue.qsize() > 0):
-            file_name = video_queue.get()  # Get the next video file name from the queue
-
-            # Create a new process for video processing
-            p = multiprocessing.Process(target=start_process, args=(file_name, processes_status_dict, video_queue))
-            p.start()  # Start the process
-            processes[p.pid] = p  # Store the process in the dictionary
-            num_active_processes += 1  # Increment the active process counter
-
-        # Check for completed processes
-        for pid, complete in processes_status_dict.items():
-            if complete:  # If the process is complete
-                processes[pid].join()  # Wait for the process to finish
-                del processes[pid]  # Remove the process from the dictionary
-                del processes_status_dict[pid]  # Remove the status from the dictionary
-                num_active_processes -= 1  # Decrement the active process counter
-
-    # Clean up temporary folders after processing is complete
-    delete_temp_folder()
+    # Each worker loads the model once and then processes videos until none are left,
+    # the main process sleeps until a video finishes
+    with ProcessPoolExecutor(num_workers, mp_context=mp_context, initializer=_init_worker,
+                             initargs=(text_cache, worker_counter, num_gpus)) as executor:
+        futures = {executor.submit(start_process, name): name for name in input_video_names}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception:
+                logging.exception(f"ERROR Processing: {futures[future]}")  # Log the failure and keep going
+
     logging.info('MAIN PROCESS COMPLETE')
 
 
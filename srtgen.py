@@ -1,41 +1,42 @@
 import os
 import time
 import logging
-import whisper_timestamped as whisper
-from moviepy.editor import VideoFileClip
+import ctranslate2
+from faster_whisper import BatchedInferencePipeline, WhisperModel
 
+from transcription import load_audio, transcribe
 from config import (
     INPUT_VIDEOS_DIR,
     OUTPUT_VIDEOS_DIR,
     MODEL_NAME,
     LANGUAGE,
+    NUM_THREADS,
+    BATCH_SIZE,
+    VAD_FILTER,
 )
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 class SRTGenerator:
-    def __init__(self, video_file: str):
-        """Initialize the SRT generator with a video file path."""
+    def __init__(self, video_file: str, model):
+        """Initialize the SRT generator with a video file path and a batched Whisper pipeline."""
         self.video_file = video_file
+        self.model = model
 
     def generate_srt(self):
         """Generate SRT file for the provided video."""
-        # Load the video and extract audio
-        clip = VideoFileClip(self.video_file)
-        audio = clip.audio
-        temp_audio_path = "temp_audio.mp3"
-        audio.write_audiofile(temp_audio_path, codec="mp3", verbose=False, logger=None)
+        # Extract the audio as mono 16 kHz samples
+        audio = load_audio(self.video_file)
+        if audio.size == 0:
+            logging.warning(f"No audio stream in {self.video_file}. Skipping SRT generation.")
+            return
 
-        # Transcribe audio using Whisper
-        loaded_audio = whisper.load_audio(temp_audio_path)
-        model = whisper.load_model(MODEL_NAME, device="cpu")
-        result = whisper.transcribe(model, loaded_audio, language=LANGUAGE, verbose=None)
-
-        # Clean up the temporary audio file
-        os.remove(temp_audio_path)
+        # Transcribe audio using Whisper (segments are generated lazily)
+        segments, _ = transcribe(self.model, audio, VAD_FILTER, BATCH_SIZE, language=LANGUAGE)
+        segments = list(segments)
 
         # Extract transcription segments for SRT
-        srt_content = self.format_srt(result['segments'])
+        srt_content = self.format_srt(segments)
 
         # Save the SRT file
         srt_file_path = os.path.join(OUTPUT_VIDEOS_DIR, os.path.basename(self.video_file).replace(".mp4", ".srt"))
@@ -48,9 +49,9 @@ class SRTGenerator:
         """Format transcription segments as an SRT string."""
         srt_content = ""
         for i, segment in enumerate(segments):
-            start_time = self.format_timestamp(segment['start'])
-            end_time = self.format_timestamp(segment['end'])
-            text = segment['text']
+            start_time = self.format_timestamp(segment.start)
+            end_time = self.format_timestamp(segment.end)
+            text = segment.text.strip()
             srt_content += f"{i + 1}\n{start_time} --> {end_time}\n{text}\n\n"
         return srt_content
     
@@ -68,11 +69,18 @@ def main():
     # Ensure output directory exists
     os.makedirs(OUTPUT_VIDEOS_DIR, exist_ok=True)
 
+    # Load the model once and reuse it for every video, on the GPU in FP16 when CUDA is available
+    if ctranslate2.get_cuda_device_count() > 0:
+        whisper_model = WhisperModel(MODEL_NAME, device="cuda", compute_type="float16")
+    else:
+        whisper_model = WhisperModel(MODEL_NAME, device="cpu", compute_type="int8", cpu_threads=NUM_THREADS)
+    model = BatchedInferencePipeline(model=whisper_model)
+
     # Process each video in the input directory
     for video_file in os.listdir(INPUT_VIDEOS_DIR):
         if video_file.endswith(".mp4"):  # Adjust if needed for different video formats
             logging.info(f"Processing {video_file}")
-            generator = SRTGenerator(os.path.join(INPUT_VIDEOS_DIR, video_file))
+            generator = SRTGenerator(os.path.join(INPUT_VIDEOS_DIR, video_file), model)
             generator.generate_srt()
 
 if __name__ == "__main__":
@@ -0,0 +1,57 @@
+import subprocess
+
+import numpy as np
+from moviepy.config import get_setting
+
+# Sample rate of the audio Whisper transcribes
+SAMPLE_RATE = 16000
+
+
+def load_audio(file_path: str) -> np.ndarray:
+    """
+    Decodes the audio track of a file straight to the mono float32 16 kHz samples
+    Whisper expects, in a single ffmpeg pass piped into memory.
+
+    :param file_path: The path of the video or audio file.
+    :return: The samples, empty if the file has no audio stream.
+    :raises subprocess.CalledProcessError: If ffmpeg fails to decode the file.
+    """
+    command = [
+        get_setting("FFMPEG_BINARY"),
+        "-loglevel", "error",
+        "-i", file_path,
+        "-map", "0:a:0?",  # The file may not have an audio track
+        "-ar", str(SAMPLE_RATE),
+        "-ac", "1",
+        "-f", "f32le",
+        "pipe:1",
+    ]
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    if result.returncode != 0:
+        # Without an audio stream ffmpeg has nothing to write and exits with an error
+        if b"does not contain any stream" in result.stderr:
+            return np.zeros(0, dtype=np.float32)
+        raise subprocess.CalledProcessError(result.returncode, command, result.stdout, result.stderr)
+
+    return np.frombuffer(result.stdout, dtype=np.float32)
+
+
+def transcribe(pipeline, samples: np.ndarray, vad_filter: bool, batch_size: int, **options):
+    """
+    Transcribes audio samples with a faster-whisper BatchedInferencePipeline.
+
+    The batched pipeline relies on voice activity detection to split audio longer than
+    30 seconds into chunks, so when vad_filter is off the pipeline's underlying
+    WhisperModel transcribes the whole audio sequentially instead.
+
+    :param pipeline: The BatchedInferencePipeline wrapping the loaded WhisperModel.
+    :param samples: The mono float32 16 kHz samples to transcribe.
+    :param vad_filter: Whether to skip the silent parts of the audio.
+    :param batch_size: The number of speech chunks transcribed in one batch.
+    :param options: Extra keyword arguments passed to faster-whisper's transcribe.
+    :return: The (segments, info) tuple returned by faster-whisper.
+    """
+    if vad_filter:
+        return pipeline.transcribe(samples, batch_size=batch_size, vad_filter=True, **options)
+    return pipeline.model.transcribe(samples, vad_filter=False, **options)